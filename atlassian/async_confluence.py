@@ -0,0 +1,303 @@
+# coding=utf-8
+"""
+Asynchronous variant of the Confluence client for concurrent REST calls.
+
+The methods mirror their blocking counterparts in ``atlassian.confluence``
+but are coroutines, so bulk operations (recursive removes, version cleanup,
+space crawls) can overlap their HTTP round trips with ``asyncio.gather``.
+Requires Python 3.5+ and the optional ``aiohttp`` dependency.
+"""
+from atlassian.async_rest_client import AsyncAtlassianRestAPI, gather_with_concurrency
+from atlassian.request_utils import get_default_logger
+
+log = get_default_logger(__name__)
+
+
+class AsyncConfluence(AsyncAtlassianRestAPI):
+
+    async def get_page_by_id(self, page_id, expand=None, status=None, version=None):
+        """
+        Returns a piece of Content.
+        :param page_id: Content ID
+        :param status: (str) list of Content statuses to filter results on. Default value: [current]
+        :param version: (int)
+        :param expand: OPTIONAL: A comma separated list of properties to expand on the content
+        :return:
+        """
+        params = {}
+        if expand:
+            params['expand'] = expand
+        if status:
+            params['status'] = status
+        if version:
+            params['version'] = version
+        url = 'rest/api/content/{page_id}'.format(page_id=page_id)
+        return await self.get(url, params=params)
+
+    async def get_page_child_by_type(self, page_id, type='page', start=None, limit=None):
+        """
+        Provide content by type (page, blog, comment)
+        :param page_id: A string containing the id of the type content container.
+        :param type:
+        :param start: OPTIONAL: The start point of the collection to return. Default: None (0).
+        :param limit: OPTIONAL: how many items should be returned after the start index. Default: Site limit 200.
+        :return:
+        """
+        params = {}
+        if start is not None:
+            params['start'] = int(start)
+        if limit is not None:
+            params['limit'] = int(limit)
+        url = 'rest/api/content/{page_id}/child/{type}'.format(page_id=page_id, type=type)
+        return ((await self.get(url, params=params)) or {}).get('results')
+
+    async def _get_all_children(self, page_id, type='page', limit=200):
+        """
+        Collect every child of a page, following pagination past the
+        server-side window; the counterpart of the sync _iter_children
+        :param page_id:
+        :param type:
+        :param limit: window size for each request
+        :return: list of child content
+        """
+        children = []
+        start = 0
+        while True:
+            window = await self.get_page_child_by_type(page_id, type=type, start=start, limit=limit) or []
+            children.extend(window)
+            if len(window) < limit:
+                return children
+            start += limit
+
+    async def get_child_pages(self, page_id):
+        """
+        Get child pages for the provided page_id
+        :param page_id:
+        :return:
+        """
+        return await self.get_page_child_by_type(page_id=page_id, type='page')
+
+    async def get_subtree_of_content_ids(self, page_id):
+        """
+        Get sub tree of page ids. The tree is walked level by level, so the
+        child listings of one level run concurrently
+        :param page_id:
+        :return: Set of page ID
+        """
+        ids = {page_id}
+        level = [page_id]
+        while level:
+            children_per_page = await gather_with_concurrency(
+                self.concurrency,
+                *(self._get_all_children(current_id) for current_id in level))
+            level = [page.get('id')
+                     for children in children_per_page if children
+                     for page in children]
+            ids.update(level)
+        return ids
+
+    async def cql(self, cql, start=0, limit=None, expand=None, include_archived_spaces=None, excerpt=None):
+        """
+        Get results from cql search result with all related fields
+        :param cql:
+        :param start: OPTIONAL: The start point of the collection to return. Default: 0.
+        :param limit: OPTIONAL: The limit of the number of issues to return, this may be restricted by
+                        fixed system limits. Default by built-in method: 25
+        :param excerpt: the excerpt strategy to apply to the result, one of : indexed, highlight, none.
+                        This defaults to highlight
+        :param expand: OPTIONAL: the properties to expand on the search result
+        :param include_archived_spaces: OPTIONAL: whether to include content in archived spaces
+        :return:
+        """
+        params = {}
+        if start is not None:
+            params['start'] = int(start)
+        if limit is not None:
+            params['limit'] = int(limit)
+        if cql is not None:
+            params['cql'] = cql
+        if expand is not None:
+            params['expand'] = expand
+        if include_archived_spaces is not None:
+            params['includeArchivedSpaces'] = include_archived_spaces
+        if excerpt is not None:
+            params['excerpt'] = excerpt
+        return await self.get('rest/api/search', params=params)
+
+    async def cql_all(self, cql, limit=200, expand=None, include_archived_spaces=None, excerpt=None):
+        """
+        Get every result of a CQL search. The first page reveals totalSize,
+        then the remaining pages are fetched concurrently
+        :param cql:
+        :param limit: OPTIONAL: page size for each request. Default: 200
+        :param excerpt: the excerpt strategy to apply to the result
+        :param expand: OPTIONAL: the properties to expand on the search result
+        :param include_archived_spaces: OPTIONAL: whether to include content in archived spaces
+        :return: list of all search results
+        """
+        first = (await self.cql(cql, start=0, limit=limit, expand=expand,
+                                include_archived_spaces=include_archived_spaces, excerpt=excerpt)) or {}
+        results = first.get('results') or []
+        total_size = int(first.get('totalSize') or len(results))
+        if total_size <= len(results):
+            return results
+        pages = await gather_with_concurrency(
+            self.concurrency,
+            *(self.cql(cql, start=start, limit=limit, expand=expand,
+                       include_archived_spaces=include_archived_spaces, excerpt=excerpt)
+              for start in range(limit, total_size, limit)))
+        for page in pages:
+            results.extend((page or {}).get('results') or [])
+        return results
+
+    async def get_all_pages_from_space(self, space, start=0, limit=50, status=None, expand=None, content_type='page'):
+        """
+        Get all pages from space. The first window is fetched alone, then the
+        following offset windows are requested concurrently until the server
+        returns a short page.
+        :param space:
+        :param start: OPTIONAL: The start point of the collection to return. Default: None (0).
+        :param limit: OPTIONAL: window size for each request. Default: 50
+        :param status: OPTIONAL: list of statuses the content to be found is in.
+        :param expand: OPTIONAL: a comma separated list of properties to expand on the content.
+        :param content_type: the content type to return. Default value: page. Valid values: page, blogpost.
+        :return: all results, across every window
+        """
+        params = {}
+        if space:
+            params['spaceKey'] = space
+        if limit:
+            params['limit'] = limit
+        if status:
+            params['status'] = status
+        if expand:
+            params['expand'] = expand
+        if content_type:
+            params['type'] = content_type
+
+        async def fetch_window(window_start):
+            window_params = dict(params, start=window_start)
+            return ((await self.get('rest/api/content', params=window_params)) or {}).get('results') or []
+
+        results = await fetch_window(start)
+        if len(results) < limit:
+            return results
+        next_start = start + limit
+        while True:
+            windows = await gather_with_concurrency(
+                self.concurrency,
+                *(fetch_window(next_start + i * limit) for i in range(self.concurrency)))
+            for window in windows:
+                results.extend(window)
+            if any(len(window) < limit for window in windows):
+                return results
+            next_start += self.concurrency * limit
+
+    async def remove_page(self, page_id, status=None, recursive=False):
+        """
+        This method removes a page, if it has recursive flag, method removes including child pages.
+        Children of the same page are removed concurrently.
+        :param page_id:
+        :param status: OPTIONAL: type of page
+        :param recursive: OPTIONAL: if True - will recursively delete all children pages too
+        :return:
+        """
+        url = 'rest/api/content/{page_id}'.format(page_id=page_id)
+        if recursive:
+            children_pages = await self._get_all_children(page_id)
+            if children_pages:
+                await gather_with_concurrency(
+                    self.concurrency,
+                    *(self.remove_page(children_page.get('id'), status, recursive)
+                      for children_page in children_pages))
+        params = {}
+        if status:
+            params['status'] = status
+        return await self.delete(url, params=params)
+
+    async def get_attachments_from_content(self, page_id, start=0, limit=50, expand=None, filename=None,
+                                           media_type=None):
+        """
+        Get attachments for page
+        :param page_id:
+        :param start:
+        :param limit:
+        :param expand:
+        :param filename:
+        :param media_type:
+        :return:
+        """
+        params = {}
+        if start:
+            params['start'] = start
+        if limit:
+            params['limit'] = limit
+        if expand:
+            params['expand'] = expand
+        if filename:
+            params['filename'] = filename
+        if media_type:
+            params['mediaType'] = media_type
+        url = 'rest/api/content/{id}/child/attachment'.format(id=page_id)
+        return await self.get(url, params=params)
+
+    async def get_attachment_history(self, attachment_id, limit=200, start=0):
+        params = {'limit': limit, 'start': start}
+        url = 'rest/experimental/content/{}/version'.format(attachment_id)
+        return ((await self.get(url, params=params)) or {}).get('results')
+
+    async def delete_attachment_by_id(self, attachment_id, version):
+        """
+        Remove completely a file if version is None or delete version
+        :param attachment_id:
+        :param version: file version
+        :return:
+        """
+        return await self.delete(
+            'rest/experimental/content/{id}/version/{versionId}'.format(id=attachment_id, versionId=version))
+
+    async def remove_page_attachment_keep_version(self, page_id, filename, keep_last_versions):
+        """
+        Keep last versions. The version history is fetched once and the stale
+        versions are deleted concurrently.
+        :param filename:
+        :param page_id:
+        :param keep_last_versions:
+        :return:
+        """
+        attachment = ((await self.get_attachments_from_content(
+            page_id=page_id, expand='version', filename=filename)) or {}).get('results')[0]
+        attachment_versions = await self.get_attachment_history(attachment.get('id'))
+        to_delete = attachment_versions[keep_last_versions:]
+        if to_delete:
+            await gather_with_concurrency(
+                self.concurrency,
+                *(self.delete_attachment_by_id(attachment_id=attachment.get('id'), version=version.get('number'))
+                  for version in to_delete))
+        log.info('Kept versions %s for %s', keep_last_versions, attachment.get('title'))
+
+    async def remove_content_history(self, page_id, version_number):
+        """
+        Remove content history. It works as experimental method
+        :param page_id:
+        :param version_number: version number
+        :return:
+        """
+        url = 'rest/experimental/content/{id}/version/{versionNumber}'.format(id=page_id,
+                                                                              versionNumber=version_number)
+        await self.delete(url)
+
+    async def remove_page_history_keep_version(self, page_id, keep_last_versions):
+        """
+        Keep last versions. The current version number is fetched once; the
+        deletes stay sequential because removing version 1 renumbers the
+        remaining versions on the server.
+        :param page_id:
+        :param keep_last_versions:
+        :return:
+        """
+        page = await self.get_page_by_id(page_id=page_id, expand='version')
+        page_number = page.get('version').get('number')
+        for _ in range(page_number - keep_last_versions):
+            await self.remove_content_history(page_id=page_id, version_number=1)
+        log.info('Kept versions %s for %s', keep_last_versions, page.get('title'))
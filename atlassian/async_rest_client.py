@@ -0,0 +1,164 @@
+# coding=utf-8
+"""
+Asynchronous variant of the REST client built on top of aiohttp.
+
+This module requires Python 3.5+ and the optional ``aiohttp`` dependency
+(``pip install atlassian-python-api[async]``), so it is not imported from
+the package root. Import it explicitly::
+
+    from atlassian.async_confluence import AsyncConfluence
+"""
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+from atlassian.request_utils import get_default_logger
+from atlassian.rest_client import AtlassianRestAPI
+
+log = get_default_logger(__name__)
+
+
+async def gather_with_concurrency(n, *coros):
+    """
+    Run coroutines concurrently, but keep no more than n of them in flight
+    at the same time
+    :param n: concurrency limit
+    :param coros: coroutines to run
+    :return: list of results in the order of coros
+    """
+    semaphore = asyncio.Semaphore(n)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(bounded(coro) for coro in coros))
+
+
+class AsyncAtlassianRestAPI(object):
+    default_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+    experimental_headers = {'Content-Type': 'application/json', 'Accept': 'application/json',
+                            'X-ExperimentalApi': 'opt-in'}
+    form_token_headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                          'X-Atlassian-Token': 'no-check'}
+
+    url_joiner = staticmethod(AtlassianRestAPI.url_joiner)
+
+    def __init__(self, url, username=None, password=None, timeout=60, api_root='rest/api', api_version='latest',
+                 verify_ssl=True, cookies=None, concurrency=10):
+        if ('atlassian.net' in url or 'jira.com' in url) \
+                and '/wiki' not in url \
+                and 'Confluence' in self.__class__.__name__:
+            url = self.url_joiner(url, '/wiki')
+        self.url = url
+        self.username = username
+        self.password = password
+        self.timeout = int(timeout)
+        self.verify_ssl = verify_ssl
+        self.api_root = api_root
+        self.api_version = api_version
+        self.cookies = cookies
+        self.concurrency = int(concurrency)
+        self._session = None
+
+    def _get_session(self):
+        """Create the aiohttp session lazily, so the client can be
+        constructed outside of a running event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                             ssl=None if self.verify_ssl else False)
+            auth = None
+            if self.username and self.password:
+                auth = aiohttp.BasicAuth(self.username, self.password)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  auth=auth,
+                                                  cookies=self.cookies,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def resource_url(self, resource):
+        return '/'.join([self.api_root, self.api_version, resource])
+
+    async def request(self, method='GET', path='/', data=None, flags=None, params=None, headers=None, trailing=None):
+        """
+        :param method:
+        :param path:
+        :param data:
+        :param flags:
+        :param params:
+        :param headers:
+        :param trailing: bool flag for trailing /
+        :return: response text
+        """
+        url = self.url_joiner(self.url, path, trailing)
+        headers = headers or self.default_headers
+        if data is not None:
+            data = json.dumps(data)
+        session = self._get_session()
+        async with session.request(method=method,
+                                   url=url,
+                                   headers=headers,
+                                   data=data,
+                                   params=params) as response:
+            text = await response.text()
+            if response.status >= 400:
+                log.error('Received: %s\n %s', response.status, text)
+            else:
+                log.debug('Received: %s', response.status)
+            return text
+
+    async def get(self, path, data=None, flags=None, params=None, headers=None, trailing=None):
+        response_text = await self.request('GET', path=path, flags=flags, params=params, data=data,
+                                           headers=headers, trailing=trailing)
+        if not response_text:
+            return None
+        try:
+            return json.loads(response_text)
+        except ValueError as e:
+            log.error(e)
+            return response_text
+
+    async def post(self, path, data=None, headers=None, params=None, trailing=None):
+        response_text = await self.request('POST', path=path, data=data, headers=headers, params=params,
+                                           trailing=trailing)
+        try:
+            return json.loads(response_text)
+        except ValueError:
+            log.debug('Received response with no content')
+            return None
+
+    async def put(self, path, data=None, headers=None, trailing=None, params=None):
+        response_text = await self.request('PUT', path=path, data=data, headers=headers, params=params,
+                                           trailing=trailing)
+        try:
+            return json.loads(response_text)
+        except ValueError:
+            log.debug('Received response with no content')
+            return None
+
+    async def delete(self, path, data=None, headers=None, params=None, trailing=None):
+        """
+        Deletes resources at given paths.
+        :rtype: dict
+        :return: Empty dictionary to have consistent interface.
+        Some of Atlassian REST resources don't return any content.
+        """
+        response_text = await self.request('DELETE', path=path, data=data, headers=headers, params=params,
+                                           trailing=trailing)
+        try:
+            return json.loads(response_text)
+        except ValueError:
+            log.debug('Received response with no content')
+            return None
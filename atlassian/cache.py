@@ -0,0 +1,90 @@
+# coding=utf-8
+import random
+import time
+
+
+class TTLCache(object):
+    """
+    Minimal in-process cache with a per-entry time-to-live and a bounded
+    size. Used by the clients to avoid re-fetching idempotent GET responses
+    within a short window. Not thread-safe beyond the guarantees of the
+    underlying dict, which is enough for the read-mostly usage here.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, jitter=0.0):
+        """
+        :param maxsize: upper bound on the number of entries
+        :param ttl: time-to-live in seconds for each entry
+        :param jitter: OPTIONAL: fraction by which each entry's lifetime is
+            randomly spread around ttl, so entries stored together do not all
+            expire (and get re-fetched) in the same instant
+        """
+        self.maxsize = int(maxsize)
+        self.ttl = ttl
+        self.jitter = jitter
+        self._data = {}
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if missing or expired
+        :param key:
+        :return:
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def put(self, key, value):
+        """
+        Store value under key for the configured time-to-live
+        :param key:
+        :param value:
+        :return:
+        """
+        if len(self._data) >= self.maxsize:
+            # Drop the oldest inserted entry to stay within bounds
+            try:
+                self._data.pop(next(iter(self._data)))
+            except (StopIteration, KeyError):
+                pass
+        ttl = self.ttl
+        if self.jitter:
+            ttl *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self._data[key] = (time.time() + ttl, value)
+
+    def discard(self, key):
+        """
+        Remove a single entry, if present
+        :param key:
+        :return:
+        """
+        self._data.pop(key, None)
+
+    def discard_matching(self, value):
+        """
+        Remove every entry whose key (a tuple) contains the given value,
+        e.g. all cached responses for one page id
+        :param value:
+        :return:
+        """
+        for key in list(self._data):
+            if value in key:
+                self._data.pop(key, None)
+
+    def discard_value(self, value):
+        """
+        Remove every entry whose stored value equals the given value
+        :param value:
+        :return:
+        """
+        for key, entry in list(self._data.items()):
+            if entry[1] == value:
+                self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
@@ -1,27 +1,128 @@
 # coding=utf-8
+import hashlib
 import logging
+import mimetypes
 import os
+import random
+import re
 import time
+from collections import deque
+from xml.etree import ElementTree
 
 from requests import HTTPError
 
 from atlassian import utils
+from .cache import TTLCache
 from .rest_client import AtlassianRestAPI
 
 log = logging.getLogger(__name__)
 
+# Keys are lower case, lookups should normalize the extension first
+CONTENT_TYPES = {
+    ".gif": "image/gif",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".pdf": "application/pdf",
+    ".doc": "application/msword",
+    ".xls": "application/vnd.ms-excel",
+    ".svg": "image/svg+xml"
+}
+
+# Page property under which the client stores a digest of the body it last
+# wrote, when use_body_hash is enabled
+BODY_HASH_PROPERTY = 'pysync.bodyHash'
+
+# Task id of a cloud PDF export, from the meta tag of the initiation page
+_TASK_ID_RE = re.compile(r'ajs-taskId"\s*content="([^"]+)"')
+
+
+def _content_digest(body):
+    """
+    Digest of a page body, used for fast content comparison
+    :param body:
+    :return:
+    """
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
 
 class Confluence(AtlassianRestAPI):
-    content_types = {
-        ".gif": "image/gif",
-        ".png": "image/png",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".pdf": "application/pdf",
-        ".doc": "application/msword",
-        ".xls": "application/vnd.ms-excel",
-        ".svg": "image/svg+xml"
-    }
+    content_types = CONTENT_TYPES
+
+    def __init__(self, url, *args, **kwargs):
+        """
+        :param url: Confluence url
+        :param cache_ttl: OPTIONAL: time-to-live in seconds for the in-process
+            cache of page lookups. Default: 0 (caching disabled). Entries for
+            a page are dropped when this client modifies it; lookups cached
+            by (space, title) simply expire with the TTL.
+        :param use_body_hash: OPTIONAL: store a digest of each written body
+            as a page property and compare against it on the next update, so
+            unchanged pages are detected with a small property GET instead of
+            downloading the full body. Default: False.
+        """
+        self.cache_ttl = int(kwargs.pop('cache_ttl', 0))
+        self.use_body_hash = kwargs.pop('use_body_hash', False)
+        # Jittered lifetimes spread out the re-fetches when many entries are
+        # stored in the same bulk loop
+        self._page_cache = TTLCache(maxsize=1024, ttl=self.cache_ttl, jitter=0.1)
+        # Last-seen attachment ids per (page_id, name), so repeated uploads of
+        # the same attachment skip the pre-flight existence GET
+        self._attachment_id_cache = TTLCache(maxsize=256, ttl=120)
+        # page_id -> parent content id; the parent of a page almost never
+        # changes, so plain memoization is enough
+        self._parent_cache = {}
+        super(Confluence, self).__init__(url, *args, **kwargs)
+
+    def _get_results(self, url, params=None):
+        """
+        GET a list endpoint and unwrap its 'results' payload. Shared tail of
+        every list helper in this class
+        :param url:
+        :param params:
+        :return:
+        """
+        return (self._get(url, params=params) or {}).get('results')
+
+    def _paginated(self, url, params=None, start=0, limit=None, page_size=200):
+        """
+        Iterate a list endpoint page by page, yielding individual results.
+        Stops after limit results when one is given, otherwise when the
+        server returns a short page, so callers are no longer silently
+        truncated by server-side page caps
+        :param url:
+        :param params:
+        :param start: offset of the first result
+        :param limit: OPTIONAL: maximum number of results to yield
+        :param page_size: how many results to request per call
+        :return: generator of results
+        """
+        params = dict(params or {})
+        if limit is not None and limit < page_size:
+            page_size = limit
+        params['limit'] = page_size
+        yielded = 0
+        while True:
+            params['start'] = start
+            results = (self._get(url, params=params) or {}).get('results') or []
+            for result in results:
+                yield result
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+            if len(results) < page_size:
+                return
+            start += len(results)
+
+    def _invalidate_page_cache(self, page_id):
+        """
+        Drop cached lookups for the given page id after a modification
+        :param page_id:
+        :return:
+        """
+        self._parent_cache.pop(str(page_id), None)
+        if self.cache_ttl:
+            self._page_cache.discard_matching(str(page_id))
 
     @staticmethod
     def _create_body(body, representation):
@@ -35,15 +136,25 @@ class Confluence(AtlassianRestAPI):
         }
 
     def page_exists(self, space, title):
+        """
+        Check if a page with the given title exists in the space. Only the
+        result size of a CQL search is inspected, so no page body is fetched
+        :param space: Space key
+        :param title: Title of the page
+        :return:
+        """
+        cql = 'space="{space}" AND title="{title}" AND type=page'.format(
+            space=space, title=str(title).replace('"', '\\"'))
         try:
-            if self.get_page_by_title(space, title):
-                log.info('Page "{title}" already exists in space "{space}"'.format(space=space, title=title))
+            response = self.get('rest/api/content/search', params={'cql': cql, 'limit': 1})
+            if (response or {}).get('size', 0) > 0:
+                log.info('Page "%s" already exists in space "%s"', title, space)
                 return True
             else:
                 log.info('Page does not exist because did not find by title search')
                 return False
         except (HTTPError, KeyError, IndexError):
-            log.info('Page "{title}" does not exist in space "{space}"'.format(space=space, title=title))
+            log.info('Page "%s" does not exist in space "%s"', title, space)
             return False
 
     def get_page_child_by_type(self, page_id, type='page', start=None, limit=None):
@@ -64,7 +175,7 @@ class Confluence(AtlassianRestAPI):
         url = 'rest/api/content/{page_id}/child/{type}'.format(page_id=page_id, type=type)
         log.info(url)
         try:
-            return (self.get(url, params=params) or {}).get('results')
+            return self._get_results(url, params=params)
         except IndexError as e:
             log.error(e)
             return None
@@ -77,6 +188,24 @@ class Confluence(AtlassianRestAPI):
         """
         return self.get_page_child_by_type(page_id=page_id, type='page')
 
+    def _iter_children(self, page_id, type='page', limit=200):
+        """
+        Iterate over every child of a page, following pagination past the
+        server-side window
+        :param page_id:
+        :param type:
+        :param limit: window size for each request
+        :return: generator of child content
+        """
+        start = 0
+        while True:
+            children = self.get_page_child_by_type(page_id, type=type, start=start, limit=limit) or []
+            for child in children:
+                yield child
+            if len(children) < limit:
+                return
+            start += limit
+
     def get_page_id(self, space, title):
         """
         Provide content id from search result by title and space
@@ -92,8 +221,17 @@ class Confluence(AtlassianRestAPI):
         :type page_id: str
         :return:
         """
-        parent_content_id = ((self.get_page_by_id(page_id=page_id, expand='ancestors').get('ancestors') or {})[-1].get(
-            'id') or None)
+        parent_content_id = self._parent_cache.get(str(page_id))
+        if parent_content_id is not None:
+            return parent_content_id
+        ancestors = (self.get_page_by_id(page_id=page_id, expand='ancestors') or {}).get('ancestors') or []
+        # The immediate parent is the last ancestor, no need to materialize
+        # a copy of the list to index it
+        for ancestor in reversed(ancestors):
+            parent_content_id = ancestor.get('id')
+            break
+        if parent_content_id is not None:
+            self._parent_cache[str(page_id)] = parent_content_id
         return parent_content_id
 
     def get_page_space(self, page_id):
@@ -133,26 +271,31 @@ class Confluence(AtlassianRestAPI):
                  If it has IndexError then return the None.
         """
         url = 'rest/api/content'
-        params = {}
         if start is not None:
-            params['start'] = int(start)
+            start = int(start)
         if limit is not None:
-            params['limit'] = int(limit)
-        if expand is not None:
-            params['expand'] = expand
-        if space is not None:
-            params['spaceKey'] = str(space)
-        if title is not None:
-            params['title'] = str(title)
+            limit = int(limit)
+        params = {key: value for key, value in (('start', start),
+                                                ('limit', limit),
+                                                ('expand', expand),
+                                                ('spaceKey', space),
+                                                ('title', title)) if value is not None}
         if self.advanced_mode:
             return self.get(url, params=params)
-        else:
-            try:
-                return (self.get(url, params=params) or {}).get('results')[0]
-            except (IndexError, TypeError) as e:
-                log.error("Can't find '{title}' page on the {url}!".format(title=title, url=self.url))
-                log.debug(e)
-                return None
+        cache_key = ('get_page_by_title', space, title, start, limit, expand)
+        if self.cache_ttl:
+            cached = self._page_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        try:
+            page = (self.get(url, params=params) or {}).get('results')[0]
+        except (IndexError, TypeError) as e:
+            log.error("Can't find '%s' page on the %s!", title, self.url)
+            log.debug(e)
+            return None
+        if self.cache_ttl and page is not None:
+            self._page_cache.put(cache_key, page)
+        return page
 
     def get_page_by_id(self, page_id, expand=None, status=None, version=None):
         """
@@ -178,7 +321,16 @@ class Confluence(AtlassianRestAPI):
         if version:
             params['version'] = version
         url = 'rest/api/content/{page_id}'.format(page_id=page_id)
-        return self.get(url, params=params)
+        cache_key = ('get_page_by_id', str(page_id), expand, status, version)
+        if self.cache_ttl and not self.advanced_mode:
+            cached = self._page_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            response = self._get(url, params=params)
+            if response is not None:
+                self._page_cache.put(cache_key, response)
+            return response
+        return self._get(url, params=params)
 
     def get_page_labels(self, page_id, prefix=None, start=None, limit=None):
         """
@@ -193,13 +345,13 @@ class Confluence(AtlassianRestAPI):
                  callback. Will raise requests.HTTPError on bad input, potentially.
         """
         url = 'rest/api/content/{id}/label'.format(id=page_id)
-        params = {}
-        if prefix:
-            params['prefix'] = prefix
         if start is not None:
-            params['start'] = int(start)
+            start = int(start)
         if limit is not None:
-            params['limit'] = int(limit)
+            limit = int(limit)
+        params = {key: value for key, value in (('prefix', prefix),
+                                                ('start', start),
+                                                ('limit', limit)) if value is not None}
         return self.get(url, params=params)
 
     def get_page_comments(self, content_id, expand=None, parent_version=None, start=0, limit=25, location=None,
@@ -215,15 +367,13 @@ class Confluence(AtlassianRestAPI):
         :param depth:
         :return:
         """
-        params = {'id': content_id, 'start': start, 'limit': limit}
-        if expand:
-            params['expand'] = expand
-        if parent_version:
-            params['parentVersion'] = parent_version
-        if location:
-            params['location'] = location
-        if depth:
-            params['depth'] = depth
+        params = {key: value for key, value in (('id', content_id),
+                                                ('start', start),
+                                                ('limit', limit),
+                                                ('expand', expand),
+                                                ('parentVersion', parent_version),
+                                                ('location', location),
+                                                ('depth', depth)) if value is not None}
         url = 'rest/api/content/{id}/child/comment'.format(id=content_id)
         return self.get(url, params=params)
 
@@ -247,15 +397,11 @@ class Confluence(AtlassianRestAPI):
         :return:
         """
         url = 'rest/api/content/search'
-        params = {}
+        params = {key: value for key, value in (('start', start), ('limit', limit)) if value}
         if label:
             params['cql'] = 'type={type} AND label="{label}"'.format(type='page',
-                                                                   label=label)
-        if start:
-            params['start'] = start
-        if limit:
-            params['limit'] = limit
-        return (self.get(url, params=params) or {}).get('results')
+                                                                     label=label)
+        return self._get_results(url, params=params)
 
     def get_all_pages_from_space(self, space, start=0, limit=50, status=None, expand=None, content_type='page'):
         """
@@ -275,21 +421,13 @@ class Confluence(AtlassianRestAPI):
         :return:
         """
         url = 'rest/api/content'
-        params = {}
-        if space:
-            params['spaceKey'] = space
-        if start:
-            params['start'] = start
-        if limit:
-            params['limit'] = limit
-        if status:
-            params['status'] = status
-        if expand:
-            params['expand'] = expand
-        if content_type:
-            params['type'] = content_type
-
-        return (self.get(url, params=params) or {}).get('results')
+        params = {key: value for key, value in (('spaceKey', space),
+                                                ('start', start),
+                                                ('limit', limit),
+                                                ('status', status),
+                                                ('expand', expand),
+                                                ('type', content_type)) if value}
+        return self._get_results(url, params=params)
 
     def get_all_pages_from_space_trash(self, space, start=0, limit=500, status='trashed', content_type='page'):
         """
@@ -328,14 +466,15 @@ class Confluence(AtlassianRestAPI):
                             fixed system limits. Default: 500
         :return:
         """
-        url = 'rest/api/content?cql=space=spaceKey={space} and status={status}'.format(space=space,
-                                                                                       status=status)
-        params = {}
+        url = 'rest/api/content'
+        # Let requests urlencode the CQL, so space keys with special
+        # characters survive the round trip
+        params = {'cql': 'space="{space}" and status="{status}"'.format(space=space, status=status)}
         if limit:
             params['limit'] = limit
         if start:
             params['start'] = start
-        return (self.get(url, params=params) or {}).get('results')
+        return self._get_results(url, params=params)
 
     def get_all_restictions_for_content(self, content_id):
         """
@@ -368,6 +507,7 @@ class Confluence(AtlassianRestAPI):
         :param content_id:
         :return:
         """
+        self._invalidate_page_cache(content_id)
         return self.delete('rest/api/content/{}'.format(content_id))
 
     def remove_page(self, page_id, status=None, recursive=False):
@@ -380,13 +520,16 @@ class Confluence(AtlassianRestAPI):
         """
         url = 'rest/api/content/{page_id}'.format(page_id=page_id)
         if recursive:
-            children_pages = self.get_page_child_by_type(page_id)
+            # Collect the full child list up front: deleting while paginating
+            # would shift the remaining windows
+            children_pages = list(self._iter_children(page_id))
             for children_page in children_pages:
                 self.remove_page(children_page.get('id'), status, recursive)
         params = {}
         if status:
             params['status'] = status
-        return self.delete(url, params=params)
+        self._invalidate_page_cache(page_id)
+        return self._delete(url, params=params)
 
     def create_page(self, space, title, body, parent_id=None, type='page',
                     representation='storage'):
@@ -400,7 +543,7 @@ class Confluence(AtlassianRestAPI):
         :param representation: OPTIONAL: either Confluence 'storage' or 'wiki' markup format
         :return:
         """
-        log.info('Creating {type} "{space}" -> "{title}"'.format(space=space, title=title, type=type))
+        log.info('Creating %s "%s" -> "%s"', type, space, title)
         url = 'rest/api/content/'
         data = {
             'type': type,
@@ -409,7 +552,10 @@ class Confluence(AtlassianRestAPI):
             'body': self._create_body(body, representation)}
         if parent_id:
             data['ancestors'] = [{'type': type, 'id': parent_id}]
-        return self.post(url, data=data)
+        response = self.post(url, data=data)
+        if self.use_body_hash and (response or {}).get('id'):
+            self._store_body_hash(response['id'], body)
+        return response
 
     def get_all_spaces(self, start=0, limit=500, expand=None):
         """
@@ -420,14 +566,10 @@ class Confluence(AtlassianRestAPI):
         :param expand: OPTIONAL: additional info, e.g. metadata, icon, description, homepage
         """
         url = 'rest/api/space'
-        params = {}
-        if start:
-            params['start'] = start
-        if limit:
-            params['limit'] = limit
-        if expand:
-            params['expand'] = expand
-        return (self.get(url, params=params) or {}).get('results')
+        params = {key: value for key, value in (('start', start),
+                                                ('limit', limit),
+                                                ('expand', expand)) if value}
+        return self._get_results(url, params=params)
 
     def add_comment(self, page_id, text):
         """
@@ -470,14 +612,20 @@ class Confluence(AtlassianRestAPI):
                 "contentType": content_type,
                 "comment": comment,
                 "minorEdit": "true"}
-            headers = {
-                'X-Atlassian-Token': 'nocheck',
-                'Accept': 'application/json'}
+            headers = self.attach_headers
             path = 'rest/api/content/{page_id}/child/attachment'.format(page_id=page_id)
-            # Check if there is already a file with the same name
-            attachments = self.get(path=path, headers=headers, params={'filename': name})
-            if attachments.get('size'):
-                path = path + '/' + attachments['results'][0]['id'] + '/data'
+            attachment_cache_key = (str(page_id), name)
+            attachment_id = self._attachment_id_cache.get(attachment_cache_key)
+            if attachment_id:
+                path = path + '/' + attachment_id + '/data'
+            else:
+                # Check if there is already a file with the same name
+                attachments = self.get(path=path, headers=headers, params={'filename': name})
+                if attachments.get('size'):
+                    attachment_id = attachments['results'][0]['id']
+                    self._attachment_id_cache.put(attachment_cache_key, attachment_id)
+                    path = path + '/' + attachment_id + '/data'
+            self._invalidate_page_cache(page_id)
             return self.post(path=path, data=data, headers=headers,
                              files={'file': (name, content, content_type)})
         else:
@@ -508,13 +656,16 @@ class Confluence(AtlassianRestAPI):
         if name is None:
             name = os.path.basename(filename)
         if content_type is None:
-            extension = os.path.splitext(filename)[-1]
-            content_type = self.content_types.get(extension, "application/binary")
+            extension = os.path.splitext(filename)[-1].lower()
+            content_type = self.content_types.get(extension) \
+                or mimetypes.guess_type(filename)[0] \
+                or "application/binary"
 
+        # Pass the open file object through, so requests streams the upload
+        # instead of holding the whole attachment in memory
         with open(filename, 'rb') as infile:
-            content = infile.read()
-        return self.attach_content(content, name, content_type, page_id=page_id, title=title, space=space,
-                                   comment=comment)
+            return self.attach_content(infile, name, content_type, page_id=page_id, title=title, space=space,
+                                       comment=comment)
 
     def delete_attachment(self, page_id, filename, version=None):
         """
@@ -527,6 +678,7 @@ class Confluence(AtlassianRestAPI):
         params = {'pageId': page_id, 'fileName': filename}
         if version:
             params['version'] = version
+        self._attachment_id_cache.discard((str(page_id), filename))
         return self.post('json/removeattachment.action', params=params, headers=self.form_token_headers)
 
     def delete_attachment_by_id(self, attachment_id, version):
@@ -536,6 +688,7 @@ class Confluence(AtlassianRestAPI):
         :param version: file version
         :return:
         """
+        self._attachment_id_cache.discard_value(attachment_id)
         return self.delete(
             'rest/experimental/content/{id}/version/{versionId}'.format(id=attachment_id, versionId=version))
 
@@ -550,15 +703,14 @@ class Confluence(AtlassianRestAPI):
         attachment = \
             self.get_attachments_from_content(page_id=page_id, expand='version', filename=filename).get(
                 'results')[0]
+        # Fetch the history once and compute the delete set locally instead of
+        # re-fetching it after every delete
         attachment_versions = self.get_attachment_history(attachment.get("id"))
-        while len(attachment_versions) > keep_last_versions:
-            remove_version_attachment_number = attachment_versions[keep_last_versions].get('number')
-            self.delete_attachment_by_id(attachment_id=attachment.get("id"), version=remove_version_attachment_number)
-            log.info(
-                "Removed oldest version for {}, now versions equal more than {}".format(attachment.get('title'),
-                                                                                        len(attachment_versions)))
-            attachment_versions = self.get_attachment_history(attachment.get("id"))
-        log.info("Kept versions {} for {}".format(keep_last_versions, attachment.get('title')))
+        for attachment_version in attachment_versions[keep_last_versions:]:
+            self.delete_attachment_by_id(attachment_id=attachment.get("id"),
+                                         version=attachment_version.get('number'))
+            log.info("Removed version %s for %s", attachment_version.get('number'), attachment.get('title'))
+        log.info("Kept versions %s for %s", keep_last_versions, attachment.get('title'))
 
     def get_attachment_history(self, attachment_id, limit=200, start=0):
         params = {'limit': limit, 'start': start}
@@ -577,18 +729,12 @@ class Confluence(AtlassianRestAPI):
         :param media_type:
         :return:
         """
-        params = {}
-        if start:
-            params['start'] = start
-        if limit:
-            params['limit'] = limit
-        if expand:
-            params['expand'] = expand
-        if filename:
-            params['filename'] = filename
-        if media_type:
-            params['mediaType'] = media_type
-        url = 'rest/api/content/{id}/child/attachment'.format(id=page_id, params=params)
+        params = {key: value for key, value in (('start', start),
+                                                ('limit', limit),
+                                                ('expand', expand),
+                                                ('filename', filename),
+                                                ('mediaType', media_type)) if value}
+        url = 'rest/api/content/{id}/child/attachment'.format(id=page_id)
         return self.get(url, params=params)
 
     def set_page_label(self, page_id, label):
@@ -601,6 +747,7 @@ class Confluence(AtlassianRestAPI):
         url = 'rest/api/content/{page_id}/label'.format(page_id=page_id)
         data = {'prefix': 'global',
                 'name': label}
+        self._invalidate_page_cache(page_id)
         return self.post(path=url, data=data)
 
     def remove_page_label(self, page_id, label):
@@ -613,11 +760,12 @@ class Confluence(AtlassianRestAPI):
         url = 'rest/api/content/{page_id}/label'.format(page_id=page_id)
         params = {'id': page_id,
                   'name': label}
+        self._invalidate_page_cache(page_id)
         return self.delete(path=url, params=params)
 
     def history(self, page_id):
         url = 'rest/api/content/{0}/history'.format(page_id)
-        return self.get(url)
+        return self._get(url)
 
     def get_content_history(self, content_id):
         return self.history(content_id)
@@ -664,12 +812,13 @@ class Confluence(AtlassianRestAPI):
         """
         page = self.get_page_by_id(page_id=page_id, expand='version')
         page_number = page.get('version').get('number')
-        while page_number > keep_last_versions:
+        # The version number decreases by one per delete, so there is no need
+        # to re-fetch the page between iterations
+        for _ in range(page_number - keep_last_versions):
             self.remove_page_history(page_id=page_id, version_number=1)
-            page = self.get_page_by_id(page_id=page_id, expand='version')
-            page_number = page.get('version').get('number')
-            log.info("Removed oldest version for {}, now it's {}".format(page.get('title'), page_number))
-        log.info("Kept versions {} for {}".format(keep_last_versions, page.get('title')))
+            page_number -= 1
+            log.info("Removed oldest version for %s, now it's %s", page.get('title'), page_number)
+        log.info("Kept versions %s for %s", keep_last_versions, page.get('title'))
 
     def has_unknown_attachment_error(self, page_id):
         """
@@ -678,13 +827,65 @@ class Confluence(AtlassianRestAPI):
         :return:
         """
         unknown_attachment_identifier = 'plugins/servlet/confluence/placeholder/unknown-attachment'
-        result = self.get_page_by_id(page_id, expand='body.view')
-        if len(result) == 0:
+        path = 'rest/api/content/{page_id}'.format(page_id=page_id)
+        # Scan the response in chunks, so huge page bodies are never held in
+        # memory just for a substring search
+        response = self.request('GET', path=path, params={'expand': 'body.view'}, stream=True)
+        found = False
+        carry = ''
+        try:
+            for chunk in response.iter_content(chunk_size=65536, decode_unicode=True):
+                if unknown_attachment_identifier in carry + chunk:
+                    found = True
+                    break
+                # Keep a tail of everything seen so far, in case the
+                # identifier straddles several small chunks
+                carry = (carry + chunk)[-(len(unknown_attachment_identifier) - 1):]
+        finally:
+            response.close()
+        if not found:
             return ""
-        body = (((result.get('body') or {}).get('view') or {}).get('value') or {})
-        if unknown_attachment_identifier in body:
-            return result.get('_links').get('base') + result.get('_links').get('tinyui')
-        return ""
+        # Only the links are needed now, which is a small follow-up request
+        result = self.get_page_by_id(page_id) or {}
+        return result.get('_links').get('base') + result.get('_links').get('tinyui')
+
+    def _body_hash_is_current(self, page_id, body):
+        """
+        Compare the digest of the new body against the hash property stored
+        by a previous write. The property response is a couple of hundred
+        bytes, against the full body download of the fallback comparison
+        :param page_id:
+        :param body:
+        :return: True if the stored hash matches
+        """
+        stored = (self.get_page_property(page_id, BODY_HASH_PROPERTY) or {}).get('value')
+        return stored is not None and stored == _content_digest(body)
+
+    def _store_body_hash(self, page_id, body):
+        """
+        Persist the digest of the body just written as a page property
+        :param page_id:
+        :param body:
+        :return:
+        """
+        data = {'key': BODY_HASH_PROPERTY, 'value': _content_digest(body)}
+        current = self.get_page_property(page_id, BODY_HASH_PROPERTY) or {}
+        version = (current.get('version') or {}).get('number')
+        if version:
+            data['version'] = {'number': version + 1}
+            url = 'rest/api/content/{page_id}/property/{key}'.format(page_id=page_id, key=BODY_HASH_PROPERTY)
+            return self.put(url, data=data)
+        return self.set_page_property(page_id, data)
+
+    def _get_page_for_update(self, page_id):
+        """
+        Fetch the current body and version of a page in a single request,
+        for the update paths that used to issue separate content and
+        history calls
+        :param page_id:
+        :return:
+        """
+        return self.get_page_by_id(page_id, expand='body.storage,version')
 
     def is_page_content_is_already_updated(self, page_id, body):
         """
@@ -693,21 +894,43 @@ class Confluence(AtlassianRestAPI):
         :param body: Body for compare it
         :return: True if the same
         """
+        cache_key = ('content_digest', str(page_id))
+        if self.cache_ttl and self._page_cache.get(cache_key) == _content_digest(body):
+            log.warning('Content of %s is exactly the same', page_id)
+            return True
+
         confluence_content = (((self.get_page_by_id(page_id, expand='body.storage') or {})
                                .get('body') or {})
                               .get('storage') or {}).get('value')
-        if confluence_content:
+        return self._page_content_is_current(page_id, confluence_content, body)
+
+    def _page_content_is_current(self, page_id, confluence_content, body):
+        """
+        Compare an already fetched storage body against the new one
+        :param page_id:
+        :param confluence_content: current storage value from the server
+        :param body: Body for compare it
+        :return: True if the same
+        """
+        cache_key = ('content_digest', str(page_id))
+        if self.cache_ttl and self._page_cache.get(cache_key) == _content_digest(body):
+            log.warning('Content of %s is exactly the same', page_id)
+            return True
+        if confluence_content and confluence_content != body:
+            # Only pay for entity normalization when the raw values differ
             # @todo move into utils
             confluence_content = utils.symbol_normalizer(confluence_content)
 
-        log.debug('Old Content: """{body}"""'.format(body=confluence_content))
-        log.debug('New Content: """{body}"""'.format(body=body))
+        log.debug('Old Content: """%s"""', confluence_content)
+        log.debug('New Content: """%s"""', body)
 
         if confluence_content == body:
-            log.warning('Content of {page_id} is exactly the same'.format(page_id=page_id))
+            if self.cache_ttl:
+                self._page_cache.put(cache_key, _content_digest(body))
+            log.warning('Content of %s is exactly the same', page_id)
             return True
         else:
-            log.info('Content of {page_id} differs'.format(page_id=page_id))
+            log.info('Content of %s differs', page_id)
             return False
 
     def update_existing_page(self, page_id, title, body, type='page', representation='storage',
@@ -731,18 +954,24 @@ class Confluence(AtlassianRestAPI):
             If False then notifications will be sent.
         :return:
         """
-        log.info('Updating {type} "{title}"'.format(title=title, type=type))
+        log.info('Updating %s "%s"', type, title)
 
-        if self.is_page_content_is_already_updated(page_id, body):
+        if self.use_body_hash and self._body_hash_is_current(page_id, body):
+            log.warning('Content of %s is exactly the same', page_id)
             return self.get_page_by_id(page_id)
+        # One expanded request covers the comparison body and the version,
+        # replacing the separate content and history lookups
+        page = self._get_page_for_update(page_id)
+        try:
+            version = page['version']['number'] + 1
+        except (IndexError, TypeError) as e:
+            log.error("Can't find '%s' %s!", title, type)
+            log.debug(e)
+            return None
+        previous_body = ((page.get('body') or {}).get('storage') or {}).get('value')
+        if self._page_content_is_current(page_id, previous_body, body):
+            return page
         else:
-            try:
-                version = self.history(page_id)['lastUpdated']['number'] + 1
-            except (IndexError, TypeError) as e:
-                log.error("Can't find '{title}' {type}!".format(title=title, type=type))
-                log.debug(e)
-                return None
-
             data = {
                 'id': page_id,
                 'type': type,
@@ -755,7 +984,11 @@ class Confluence(AtlassianRestAPI):
             if parent_id:
                 data['ancestors'] = [{'type': 'page', 'id': parent_id}]
 
-            return self.put('rest/api/content/{0}'.format(page_id), data=data)
+            self._invalidate_page_cache(page_id)
+            response = self.put('rest/api/content/{0}'.format(page_id), data=data)
+            if self.use_body_hash and response:
+                self._store_body_hash(page_id, body)
+            return response
 
     def append_page(self, page_id, title, append_body, parent_id=None, type='page', representation='storage',
                     minor_edit=False):
@@ -771,16 +1004,18 @@ class Confluence(AtlassianRestAPI):
             If False then notifications will be sent.
         :return:
         """
-        log.info('Updating {type} "{title}"'.format(title=title, type=type))
+        log.info('Updating %s "%s"', type, title)
 
-        if self.is_page_content_is_already_updated(page_id, append_body):
-            return self.get_page_by_id(page_id)
+        # Body and version come from one expanded request
+        page = self._get_page_for_update(page_id)
+        previous_body = ((page.get('body') or {}).get('storage') or {}).get('value')
+        if self._page_content_is_current(page_id, previous_body, append_body):
+            return page
         else:
-            version = self.history(page_id)['lastUpdated']['number'] + 1
-            previous_body = (self.get_page_by_id(page_id, expand='body.storage').get('body') or {}).get(
-                'storage').get(
-                'value')
-            previous_body = previous_body.replace('&oacute;', u'ó')
+            version = page['version']['number'] + 1
+            # Single compiled-regex pass over the whole entity table, rather
+            # than fixing up one entity with str.replace
+            previous_body = utils.symbol_normalizer(previous_body)
             body = previous_body + append_body
             data = {
                 'id': page_id,
@@ -794,6 +1029,7 @@ class Confluence(AtlassianRestAPI):
             if parent_id:
                 data['ancestors'] = [{'type': 'page', 'id': parent_id}]
 
+            self._invalidate_page_cache(page_id)
             return self.put('rest/api/content/{0}'.format(page_id), data=data)
 
     def update_or_create(self, parent_id, title, body, representation='storage', minor_edit=False):
@@ -817,11 +1053,49 @@ class Confluence(AtlassianRestAPI):
             result = self.create_page(space=space, parent_id=parent_id, title=title, body=body,
                                       representation=representation)
 
-        log.info('You may access your page at: {host}{url}'.format(host=self.url,
-                                                                   url=((result or {})
-                                                                        .get('_links') or {}).get('tinyui')))
+        log.info('You may access your page at: %s%s', self.url,
+                 ((result or {}).get('_links') or {}).get('tinyui'))
         return result
 
+    def update_or_create_many(self, parent_id, pages, representation='storage', minor_edit=False):
+        """
+        Update or create a batch of pages under a common parent. Existence
+        and content ids for the whole batch are resolved with a single CQL
+        search, instead of a space lookup plus existence check per page
+        :param parent_id: parent for the pages that need to be created
+        :param pages: list of dicts with 'title' and 'body' keys
+        :param representation: OPTIONAL: either Confluence 'storage' or 'wiki' markup format
+        :param minor_edit: Update page without notification
+        :return: list of responses, one per entry of pages, in order
+        """
+        space = self.get_page_space(parent_id)
+        quoted_titles = ', '.join('"{0}"'.format(str(page['title']).replace('"', '\\"'))
+                                  for page in pages)
+        cql = 'space="{space}" AND type=page AND title in ({titles})'.format(
+            space=space, titles=quoted_titles)
+        existing = {}
+        start = 0
+        limit = 200
+        while True:
+            results = (self.cql(cql, start=start, limit=limit) or {}).get('results') or []
+            for result in results:
+                content = result.get('content') or {}
+                existing[content.get('title')] = content.get('id')
+            if len(results) < limit:
+                break
+            start += limit
+        responses = []
+        for page in pages:
+            title = page['title']
+            page_id = existing.get(title)
+            if page_id:
+                responses.append(self.update_page(page_id=page_id, title=title, body=page['body'],
+                                                  representation=representation, minor_edit=minor_edit))
+            else:
+                responses.append(self.create_page(space=space, parent_id=parent_id, title=title,
+                                                  body=page['body'], representation=representation))
+        return responses
+
     def convert_wiki_to_storage(self, wiki):
         """
         Convert to Confluence XHTML format from wiki style
@@ -864,6 +1138,26 @@ class Confluence(AtlassianRestAPI):
                                                                            page_property=str(page_property))
         return self.delete(path=url)
 
+    def delete_page_properties(self, page_id, page_properties, max_workers=8):
+        """
+        Delete several page (content) properties. The deletes run on a
+        thread pool over the pooled session where the interpreter provides
+        one, so total time scales with parallelism instead of key count
+        :param page_id: content_id format
+        :param page_properties: iterable of property keys
+        :param max_workers: OPTIONAL: number of concurrent deletes
+        :return: list of responses, in the order of page_properties
+        """
+        page_properties = list(page_properties)
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            # Python 2: no concurrent.futures in the stdlib, delete serially
+            return [self.delete_page_property(page_id, key) for key in page_properties]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda key: self.delete_page_property(page_id, key),
+                                     page_properties))
+
     def get_page_property(self, page_id, page_property_key):
         """
         Get the page (content) property e.g. get key of hash
@@ -916,10 +1210,7 @@ class Confluence(AtlassianRestAPI):
                                 fixed system limits. Default: 1000
         :return:
         """
-        url = 'rest/api/group?limit={limit}&start={start}'.format(limit=limit,
-                                                                  start=start)
-
-        return (self.get(url) or {}).get('results')
+        return list(self._paginated('rest/api/group', start=start, limit=limit))
 
     def get_group_members(self, group_name='confluence-users', start=0, limit=1000, expand=None):
         """
@@ -931,23 +1222,34 @@ class Confluence(AtlassianRestAPI):
         :param expand: OPTIONAL: A comma separated list of properties to expand on the content. status
         :return:
         """
-        url = 'rest/api/group/{group_name}/member?limit={limit}&start={start}&expand={expand}'.format(
-            group_name=group_name,
-            limit=limit,
-            start=start,
-            expand=expand)
-        return (self.get(url) or {}).get('results')
+        params = {}
+        if expand:
+            params['expand'] = expand
+        url = 'rest/api/group/{group_name}/member'.format(group_name=group_name)
+        return list(self._paginated(url, params=params, start=start, limit=limit))
 
     def get_space(self, space_key, expand='description.plain,homepage'):
         """
-        Get information about a space through space key
+        Get information about a space through space key. Cached for
+        cache_ttl seconds when caching is enabled, since space metadata
+        rarely changes within a script's lifetime
         :param space_key: The unique space key name
         :param expand: OPTIONAL: additional info from description, homepage
         :return: Returns the space along with its ID
         """
-        url = 'rest/api/space/{space_key}?expand={expand}'.format(space_key=space_key,
-                                                                  expand=expand)
-        return self.get(url)
+        cache_key = ('get_space', space_key, expand)
+        if self.cache_ttl:
+            cached = self._page_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        params = {}
+        if expand:
+            params['expand'] = expand
+        url = 'rest/api/space/{space_key}'.format(space_key=space_key)
+        response = self.get(url, params=params)
+        if self.cache_ttl and response is not None:
+            self._page_cache.put(cache_key, response)
+        return response
 
     def create_space(self, space_key, space_name):
         """
@@ -968,6 +1270,8 @@ class Confluence(AtlassianRestAPI):
         :param space_key:
         :return:
         """
+        if self.cache_ttl:
+            self._page_cache.discard_matching(space_key)
         url = 'rest/api/space/{}'.format(space_key)
         return self.delete(url)
 
@@ -1015,43 +1319,63 @@ class Confluence(AtlassianRestAPI):
                                     this defaults to false
         :return:
         """
-        params = {}
-        if start is not None:
-            params['start'] = int(start)
-        if limit is not None:
-            params['limit'] = int(limit)
-        if cql is not None:
-            params['cql'] = cql
-        if expand is not None:
-            params['expand'] = expand
-        if include_archived_spaces is not None:
-            params['includeArchivedSpaces'] = include_archived_spaces
-        if excerpt is not None:
-            params['excerpt'] = excerpt
+        params = {key: value for key, value in (
+            ('start', int(start) if start is not None else None),
+            ('limit', int(limit) if limit is not None else None),
+            ('cql', cql),
+            ('expand', expand),
+            ('includeArchivedSpaces', include_archived_spaces),
+            ('excerpt', excerpt)) if value is not None}
 
-        return self.get('rest/api/search', params=params)
+        return self._get('rest/api/search', params=params)
 
-    def get_page_as_pdf(self, page_id):
+    def _download_to_file(self, url, fh, headers, chunk_size):
+        """
+        Stream a binary endpoint into the given file object in chunks, so
+        peak memory stays at chunk size instead of the full file size
+        :param url:
+        :param fh: writable binary file object
+        :param headers:
+        :param chunk_size:
+        :return: fh
+        """
+        response = self.request('GET', path=url, headers=headers, stream=True)
+        for chunk in response.iter_content(chunk_size):
+            fh.write(chunk)
+        return fh
+
+    def get_page_as_pdf(self, page_id, fh=None, chunk_size=64 * 1024):
         """
         Export page as standard pdf exporter
         :param page_id: Page ID
-        :return: PDF File
+        :param fh: OPTIONAL: writable binary file object. When given, the
+            PDF is streamed into it chunk by chunk and fh is returned,
+            instead of buffering the whole document in memory
+        :param chunk_size: OPTIONAL: streaming chunk size in bytes
+        :return: PDF File, or fh when provided
         """
         headers = self.form_token_headers
         url = 'spaces/flyingpdf/pdfpageexport.action?pageId={pageId}'.format(pageId=page_id)
         if self.api_version == 'cloud':
             url = self.get_pdf_download_url_for_confluence_cloud(url)
 
+        if fh is not None:
+            return self._download_to_file(url, fh, headers, chunk_size)
         return self.get(url, headers=headers, not_json_response=True)
 
-    def get_page_as_word(self, page_id):
+    def get_page_as_word(self, page_id, fh=None, chunk_size=64 * 1024):
         """
         Export page as standard word exporter.
         :param page_id: Page ID
-        :return: Word File
+        :param fh: OPTIONAL: writable binary file object to stream into,
+            see get_page_as_pdf
+        :param chunk_size: OPTIONAL: streaming chunk size in bytes
+        :return: Word File, or fh when provided
         """
         headers = self.form_token_headers
         url = 'exportword?pageId={pageId}'.format(pageId=page_id)
+        if fh is not None:
+            return self._download_to_file(url, fh, headers, chunk_size)
         return self.get(url, headers=headers, not_json_response=True)
 
     def export_page(self, page_id):
@@ -1070,18 +1394,13 @@ class Confluence(AtlassianRestAPI):
         :param title: str
         :return: page_id of the page whose title is passed in argument
         """
-        page_id = ""
-
-        url = 'rest/api/content/search?cql=parent={}%20AND%20space="{}"'.format(
-            parent_id, space
-        )
-        response = self.get(url, {})
-
-        for each_page in response.get("results", []):
-            if each_page.get("title") == title:
-                page_id = each_page.get("id")
-                break
-        return page_id
+        cql = 'parent={parent_id} AND space="{space}" AND title="{title}"'.format(
+            parent_id=parent_id,
+            space=str(space).replace('"', '\\"'),
+            title=str(title).replace('"', '\\"'))
+        # The server filters on title, so only the matching page comes back
+        results = self._get_results('rest/api/content/search', params={'cql': cql, 'limit': 1})
+        return results[0].get("id", "") if results else ""
 
     def reindex(self):
         """
@@ -1117,18 +1436,16 @@ class Confluence(AtlassianRestAPI):
         Enable Synchrony
         :return:
         """
-        headers = {'X-Atlassian-Token': 'no-check'}
         url = 'rest/synchrony-interop/enable'
-        return self.post(url, headers=headers)
+        return self.post(url, headers=self.no_check_headers)
 
     def synchrony_disable(self):
         """
         Disable Synchrony
         :return:
         """
-        headers = {'X-Atlassian-Token': 'no-check'}
         url = 'rest/synchrony-interop/disable'
-        return self.post(url, headers=headers)
+        return self.post(url, headers=self.no_check_headers)
 
     def check_access_mode(self):
         return self.get("rest/api/accessmode")
@@ -1146,16 +1463,12 @@ class Confluence(AtlassianRestAPI):
         :param plugin_path:
         :return:
         """
-        files = {
-            'plugin': open(plugin_path, 'rb')
-        }
-        headers = {
-            'X-Atlassian-Token': 'nocheck'
-        }
+        headers = self.attach_headers
         upm_token = self.request(method='GET', path='rest/plugins/1.0/', headers=headers, trailing=True).headers[
             'upm-token']
         url = 'rest/plugins/1.0/?token={upm_token}'.format(upm_token=upm_token)
-        return self.post(url, files=files, headers=headers)
+        with open(plugin_path, 'rb') as plugin_file:
+            return self.post(url, files={'plugin': plugin_file}, headers=headers)
 
     def delete_plugin(self, plugin_key):
         """
@@ -1213,32 +1526,45 @@ class Confluence(AtlassianRestAPI):
             log.info('Initiate PDF export from Confluence Cloud')
             response = self.get(url, headers=headers, not_json_response=True)
             response_string = response.decode(encoding='utf-8', errors='strict')
-            task_id = response_string.split('name="ajs-taskId" content="')[1].split('">')[0]
-            poll_url = 'runningtaskxml.action?taskId={0}'.format(task_id)
+            task_id_match = _TASK_ID_RE.search(response_string)
+            if task_id_match is None:
+                log.error('Can not find the task id in the export initiation response')
+                return None
+            poll_url = 'runningtaskxml.action?taskId={0}'.format(task_id_match.group(1))
+            attempt = 0
             while long_running_task:
                 long_running_task_response = self.get(poll_url, headers=headers, not_json_response=True)
-                long_running_task_response_parts = long_running_task_response.decode(encoding='utf-8',
-                                                                                     errors='strict').split('\n')
-                percentage_complete = long_running_task_response_parts[6].strip()
-                is_successful = long_running_task_response_parts[7].strip()
-                is_complete = long_running_task_response_parts[8].strip()
-                log.info('Sleep for 5s.')
-                time.sleep(5)
+                task = ElementTree.fromstring(long_running_task_response)
+                percentage_complete = (task.findtext('percentageComplete') or '').strip()
+                is_successful = (task.findtext('isSuccessful') or '').strip()
+                is_complete = (task.findtext('isComplete') or '').strip()
                 log.info('Check if export task has completed.')
-                if is_complete == '<isComplete>true</isComplete>':
-                    if is_successful == '<isSuccessful>true</isSuccessful>':
-                        log.info(percentage_complete)
+                if is_complete == 'true':
+                    if is_successful == 'true':
+                        log.info('Task completed at %s%%', percentage_complete)
                         log.info('Downloading content...')
                         log.debug('Extract taskId and download PDF.')
-                        current_status = long_running_task_response_parts[3]
-                        download_url = current_status.split('href=&quot;/wiki/')[1].split('&quot')[0]
+                        # findtext decodes XML entities, so the &quot; of the
+                        # raw payload is already a plain double quote here
+                        current_status = task.findtext('currentStatus') or ''
+                        download_url = current_status.split('href="/wiki/')[1].split('"')[0]
                         long_running_task = False
-                    elif is_successful == '<isSuccessful>false</isSuccessful>':
+                    else:
                         log.error('PDF conversion not successful.')
                         return None
                 else:
-                    log.info(percentage_complete)
-        except IndexError as e:
+                    log.info('Task progress: %s%%', percentage_complete)
+                    # Exponential backoff with jitter: short tasks are picked
+                    # up quickly, long ones do not hammer the server. Stay at
+                    # the base delay once the task reports it is nearly done
+                    delay = min(5.0, 0.25 * 2 ** attempt)
+                    if percentage_complete.isdigit() and int(percentage_complete) >= 90:
+                        delay = 0.25
+                    delay *= random.uniform(0.5, 1.5)
+                    log.info('Sleep for %.2fs.', delay)
+                    time.sleep(delay)
+                    attempt += 1
+        except (IndexError, ElementTree.ParseError) as e:
             log.error(e)
             return None
 
@@ -1363,15 +1689,47 @@ class Confluence(AtlassianRestAPI):
 
     def get_subtree_of_content_ids(self, page_id):
         """
-        Get sub tree of page ids
+        Get sub tree of page ids. Resolves the whole subtree with a paginated
+        CQL ancestor search - a couple of requests instead of one per page.
+        Falls back to walking the tree on deployments where the ancestor
+        field is not supported
+        :param page_id:
+        :return: Set of page ID
+        """
+        ids = {page_id}
+        start = 0
+        limit = 200
+        while True:
+            response = self.cql('ancestor={}'.format(page_id), start=start, limit=limit)
+            results = (response or {}).get('results')
+            if results is None and start == 0:
+                return self._get_subtree_of_content_ids_by_walk(page_id)
+            if not results:
+                return ids
+            for result in results:
+                content_id = (result.get('content') or {}).get('id')
+                if content_id:
+                    ids.add(content_id)
+            if len(results) < limit:
+                return ids
+            start += limit
+
+    def _get_subtree_of_content_ids_by_walk(self, page_id):
+        """
+        Get sub tree of page ids through per-node child lookups, for servers
+        without ancestor CQL support. Iterative breadth-first walk into a
+        single accumulator set: no recursion limit, no per-level list
+        copies, and the seen set guards against cycles
         :param page_id:
         :return: Set of page ID
         """
-        output = list()
-        output.append(page_id)
-        children_pages = self.get_page_child_by_type(page_id)
-        for page in children_pages:
-            child_subtree = self.get_subtree_of_content_ids(page.get('id'))
-            if child_subtree:
-                output.extend([p for p in child_subtree])
-        return set(output)
+        seen = {page_id}
+        queue = deque([page_id])
+        while queue:
+            current_id = queue.popleft()
+            for child in self.get_page_child_by_type(current_id) or ():
+                child_id = child.get('id')
+                if child_id and child_id not in seen:
+                    seen.add(child_id)
+                    queue.append(child_id)
+        return seen
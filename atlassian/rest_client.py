@@ -4,25 +4,80 @@ import logging
 
 import requests
 from oauthlib.oauth1 import SIGNATURE_RSA
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1
 from six.moves.urllib.parse import urlencode
+from urllib3.util import Retry
 
 from atlassian.request_utils import get_default_logger
 
+try:
+    import orjson as _fast_json
+except ImportError:
+    try:
+        import ujson as _fast_json
+    except ImportError:
+        _fast_json = None
+
+try:
+    import brotli  # noqa: F401
+
+    # urllib3 only decompresses brotli responses when the codec is installed
+    _ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    _ACCEPT_ENCODING = 'gzip, deflate'
+
 log = get_default_logger(__name__)
 
 
+def _json_dumps(data):
+    """
+    Serialize a request body, preferring orjson/ujson when installed.
+    orjson returns bytes, which requests sends as-is; page bodies can be
+    large enough for the encoder to matter
+    :param data:
+    :return:
+    """
+    if _fast_json is not None:
+        try:
+            if hasattr(_fast_json, 'OPT_NON_STR_KEYS'):
+                # orjson rejects non-string dict keys unless opted in, while
+                # stdlib json silently coerces them; keep the lax behaviour
+                return _fast_json.dumps(data, option=_fast_json.OPT_NON_STR_KEYS)
+            return _fast_json.dumps(data)
+        except TypeError:
+            # Whatever the accelerator rejected, encode the way a vanilla
+            # install would
+            return json.dumps(data)
+    return json.dumps(data)
+
+
+def _response_json(response):
+    """
+    Parse the response body as JSON, preferring orjson/ujson when installed.
+    Both raise a ValueError subclass on invalid input, same as response.json()
+    :param response:
+    :return:
+    """
+    if _fast_json is not None:
+        return _fast_json.loads(response.content)
+    return response.json()
+
+
 class AtlassianRestAPI(object):
     default_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
     experimental_headers = {'Content-Type': 'application/json', 'Accept': 'application/json',
                             'X-ExperimentalApi': 'opt-in'}
     form_token_headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
                           'X-Atlassian-Token': 'no-check'}
+    attach_headers = {'X-Atlassian-Token': 'nocheck', 'Accept': 'application/json'}
+    no_check_headers = {'X-Atlassian-Token': 'no-check'}
 
     response = None
 
     def __init__(self, url, username=None, password=None, timeout=60, api_root='rest/api', api_version='latest',
-                 verify_ssl=True, session=None, oauth=None, cookies=None, advanced_mode=None, kerberos=None):
+                 verify_ssl=True, session=None, oauth=None, cookies=None, advanced_mode=None, kerberos=None,
+                 use_conditional=False, retry_writes=False):
         if ('atlassian.net' in url or 'jira.com' in url) \
                 and '/wiki' not in url \
                 and self.__class__.__name__ in 'Confluence':
@@ -36,8 +91,25 @@ class AtlassianRestAPI(object):
         self.api_version = api_version
         self.cookies = cookies
         self.advanced_mode = advanced_mode
+        # Opt-in support for conditional GETs: remember the ETag of each GET
+        # response and replay the parsed body when the server answers 304
+        self.use_conditional = use_conditional
+        self._etag_cache = {}
+        self._etag_cache_maxsize = 512
+        self.retry_writes = retry_writes
         if session is None:
             self._session = requests.Session()
+            # Mount a tuned adapter, so keep-alive connections are pooled and
+            # reused across consecutive calls instead of paying a fresh
+            # TCP+TLS handshake each time. Rate-limit and gateway errors are
+            # retried with backoff, honouring the server's Retry-After
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50,
+                                  max_retries=self._build_retry(retry_writes))
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+            # Session-level header, so per-request header dicts (which never
+            # carry Accept-Encoding) don't overwrite it
+            self._session.headers.update({'Accept-Encoding': _ACCEPT_ENCODING})
         else:
             self._session = session
         if username and password:
@@ -46,6 +118,54 @@ class AtlassianRestAPI(object):
             self._create_oauth_session(oauth)
         elif kerberos is not None:
             self._create_kerberos_session(kerberos)
+        # Bound-method shortcuts for the hot call paths, saving the attribute
+        # lookup on every request in tight client loops
+        self._get = self.get
+        self._post = self.post
+        self._put = self.put
+        self._delete = self.delete
+
+    @staticmethod
+    def _build_retry(retry_writes):
+        """
+        Retry policy for the pooled adapter: back off on rate limits and
+        gateway errors. Writes are only retried when the caller opted in,
+        since a replayed POST/PUT may re-apply
+        :param retry_writes: also retry POST and PUT
+        :return: urllib3 Retry
+        """
+        methods = frozenset(['HEAD', 'GET', 'OPTIONS', 'DELETE'])
+        if retry_writes:
+            methods = methods | frozenset(['POST', 'PUT'])
+        kwargs = dict(total=3, backoff_factor=0.5,
+                      status_forcelist=[429, 502, 503, 504],
+                      respect_retry_after_header=True)
+        try:
+            return Retry(allowed_methods=methods, **kwargs)
+        except TypeError:
+            # urllib3 < 1.26 spells the option method_whitelist
+            return Retry(method_whitelist=methods, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Close the underlying session and return its pooled connections
+        :return:
+        """
+        self._session.close()
+
+    def clear_etag_cache(self):
+        """
+        Forget every stored ETag and cached response, so the next GETs hit
+        the server unconditionally
+        :return:
+        """
+        self._etag_cache.clear()
 
     def _create_basic_session(self, username, password):
         self._session.auth = (username, password)
@@ -112,7 +232,7 @@ class AtlassianRestAPI(object):
         return url_link
 
     def request(self, method='GET', path='/', data=None, flags=None, params=None, headers=None,
-                files=None, trailing=None):
+                files=None, trailing=None, stream=False):
         """
 
         :param method:
@@ -123,6 +243,8 @@ class AtlassianRestAPI(object):
         :param headers:
         :param files:
         :param trailing: bool
+        :param stream: OPTIONAL: return the raw response without reading the
+            body, so the caller can consume it with iter_content
         :return:
         """
         self.log_curl_debug(method=method, path=path, headers=headers, data=data, trailing=None)
@@ -134,9 +256,25 @@ class AtlassianRestAPI(object):
         if flags:
             url += ('&' if params else '') + '&'.join(flags or [])
         if files is None:
-            data = None if not data else json.dumps(data)
+            data = None if not data else _json_dumps(data)
 
         headers = headers or self.default_headers
+        conditional_key = None
+        if self.use_conditional and files is None and not stream and not self.advanced_mode:
+            if method == 'GET':
+                conditional_key = url
+                cached = self._etag_cache.get(conditional_key)
+                if cached is not None:
+                    headers = dict(headers)
+                    headers['If-None-Match'] = cached[0]
+            else:
+                # A write may change any cached representation of the resource
+                base_url = url.split('?', 1)[0]
+                for key in list(self._etag_cache):
+                    if key.split('?', 1)[0] == base_url:
+                        # pop: another thread may have dropped the key since
+                        # the snapshot above
+                        self._etag_cache.pop(key, None)
         response = self._session.request(
             method=method,
             url=url,
@@ -144,48 +282,67 @@ class AtlassianRestAPI(object):
             data=data,
             timeout=self.timeout,
             verify=self.verify_ssl,
-            files=files
+            files=files,
+            stream=stream
         )
         response.encoding = 'utf-8'
+        if stream:
+            return response
         if self.advanced_mode:
             self.response = response
             return response
+        if conditional_key is not None:
+            if response.status_code == 304:
+                cached = self._etag_cache.get(conditional_key)
+                if cached is not None:
+                    log.debug('Received: 304, serving the cached response')
+                    return cached[1]
+            elif response.status_code == 200:
+                etag = response.headers.get('ETag')
+                if etag:
+                    if len(self._etag_cache) >= self._etag_cache_maxsize:
+                        # Drop the oldest entry to keep the cache bounded
+                        try:
+                            del self._etag_cache[next(iter(self._etag_cache))]
+                        except (StopIteration, KeyError):
+                            pass
+                    self._etag_cache[conditional_key] = (etag, response)
         try:
             if response.text:
-                response_content = response.json()
+                response_content = _response_json(response)
             else:
                 response_content = response.content
         except ValueError:
             response_content = response.content
         if response.status_code == 200:
-            log.debug('Received: {0}\n {1}'.format(response.status_code, response_content))
+            log.debug('Received: %s\n %s', response.status_code, response_content)
         elif response.status_code == 201:
-            log.debug('Received: {0}\n "Created" response'.format(response.status_code))
+            log.debug('Received: %s\n "Created" response', response.status_code)
         elif response.status_code == 204:
-            log.debug('Received: {0}\n "No Content" response'.format(response.status_code))
+            log.debug('Received: %s\n "No Content" response', response.status_code)
         elif response.status_code == 400:
-            log.error('Received: {0}\n Bad request \n {1}'.format(response.status_code, response_content))
+            log.error('Received: %s\n Bad request \n %s', response.status_code, response_content)
         elif response.status_code == 401:
-            log.error('Received: {0}\n "UNAUTHORIZED" response'.format(response.status_code))
+            log.error('Received: %s\n "UNAUTHORIZED" response', response.status_code)
         elif response.status_code == 404:
-            log.error('Received: {0}\n Not Found'.format(response.status_code))
+            log.error('Received: %s\n Not Found', response.status_code)
         elif response.status_code == 403:
-            log.error('Received: {0}\n Forbidden. Please, check permissions'.format(response.status_code))
+            log.error('Received: %s\n Forbidden. Please, check permissions', response.status_code)
         elif response.status_code == 405:
-            log.error('Received: {0}\n Method not allowed'.format(response.status_code))
+            log.error('Received: %s\n Method not allowed', response.status_code)
         elif response.status_code == 409:
-            log.error('Received: {0}\n Conflict \n '.format(response.status_code, response_content))
+            log.error('Received: %s\n Conflict \n %s', response.status_code, response_content)
         elif response.status_code == 413:
-            log.error('Received: {0}\n Request entity too large'.format(response.status_code))
+            log.error('Received: %s\n Request entity too large', response.status_code)
         else:
-            log.debug('Received: {0}\n {1}'.format(response.status_code, response))
+            log.debug('Received: %s\n %s', response.status_code, response)
             self.log_curl_debug(method=method, path=path, headers=headers, data=data, level=logging.DEBUG)
             log.error(response_content)
             try:
                 response.raise_for_status()
             except requests.exceptions.HTTPError as err:
                 log.error("HTTP Error occurred")
-                log.error('Response is: {content}'.format(content=err.response.content))
+                log.error('Response is: %s', err.response.content)
         return response
 
     def get(self, path, data=None, flags=None, params=None, headers=None, not_json_response=None, trailing=None):
@@ -210,7 +367,7 @@ class AtlassianRestAPI(object):
             if not response.text:
                 return None
             try:
-                return response.json()
+                return _response_json(response)
             except Exception as e:
                 log.error(e)
                 return response.text
@@ -221,7 +378,7 @@ class AtlassianRestAPI(object):
         if self.advanced_mode:
             return response
         try:
-            return response.json()
+            return _response_json(response)
         except ValueError:
             log.debug('Received response with no content')
             return None
@@ -232,7 +389,7 @@ class AtlassianRestAPI(object):
         if self.advanced_mode:
             return response
         try:
-            return response.json()
+            return _response_json(response)
         except ValueError:
             log.debug('Received response with no content')
             return None
@@ -248,7 +405,7 @@ class AtlassianRestAPI(object):
         if self.advanced_mode:
             return response
         try:
-            return response.json()
+            return _response_json(response)
         except ValueError:
             log.debug('Received response with no content')
             return None
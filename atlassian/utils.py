@@ -211,51 +211,62 @@ def noformat_code_macro_confluence(text, nopanel=None):
             ''').format(nopanel=nopanel, text=text)
 
 
+SYMBOL_TABLE = {
+    '&Auml;': u'Ä',
+    '&auml;': u'ä',
+    '&Euml;': u'Ë',
+    '&euml;': u'ë',
+    '&Iuml;': u'Ï',
+    '&iuml;': u'ï',
+    '&Ouml;': u'Ö',
+    '&ouml;': u'ö',
+    '&Uuml;': u'Ü',
+    '&uuml;': u'ü',
+    '&Aacute;': u'Á',
+    '&aacute;': u'á',
+    '&Eacute;': u'É',
+    '&eacute;': u'é',
+    '&Iacute;': u'Í',
+    '&iacute;': u'í',
+    '&Oacute;': u'Ó',
+    '&oacute;': u'ó',
+    '&Uacute;': u'Ú',
+    '&uacute;': u'ú',
+    '&Agrave;': u'À',
+    '&agrave;': u'à',
+    '&Egrave;': u'È',
+    '&egrave;': u'è',
+    '&Igrave;': u'Ì',
+    '&igrave;': u'ì',
+    '&Ograve;': u'Ò',
+    '&ograve;': u'ò',
+    '&Ugrave;': u'Ù',
+    '&ugrave;': u'ù',
+    '&Acirc;': u'Â',
+    '&acirc;': u'â',
+    '&Ecirc;': u'Ê',
+    '&ecirc;': u'ê',
+    '&Icirc;': u'Î',
+    '&icirc;': u'î',
+    '&Ocirc;': u'Ô',
+    '&ocirc;': u'ô',
+    '&Ucirc;': u'Û',
+    '&ucirc;': u'û',
+    '&Aring;': u'Å',
+    '&aring;': u'å',
+    '&deg;': u'°',
+}
+
+_SYMBOL_RE = re.compile('|'.join(re.escape(key) for key in SYMBOL_TABLE))
+
+
 def symbol_normalizer(text):
+    """
+    Replace well-known HTML entities with their unicode symbols in a single
+    compiled-regex pass
+    :param text:
+    :return:
+    """
     if not text:
         return ""
-    result = text
-    result = result.replace('&Auml;', u'Ä')
-    result = result.replace('&auml;', u'ä')
-    result = result.replace('&Euml;', u'Ë')
-    result = result.replace('&euml;', u'ë')
-    result = result.replace('&Iuml;', u'Ï')
-    result = result.replace('&iuml;', u'ï')
-    result = result.replace('&Ouml;', u'Ö')
-    result = result.replace('&ouml;', u'ö')
-    result = result.replace('&Uuml;', u'Ü')
-    result = result.replace('&uuml;', u'ü')
-    result = result.replace('&Aacute;', u'Á')
-    result = result.replace('&aacute;', u'á')
-    result = result.replace('&Eacute;', u'É')
-    result = result.replace('&eacute;', u'é')
-    result = result.replace('&Iacute;', u'Í')
-    result = result.replace('&iacute;', u'í')
-    result = result.replace('&Oacute;', u'Ó')
-    result = result.replace('&oacute;', u'ó')
-    result = result.replace('&Uacute;', u'Ú')
-    result = result.replace('&uacute;', u'ú')
-    result = result.replace('&Agrave;', u'À')
-    result = result.replace('&agrave;', u'à')
-    result = result.replace('&Egrave;', u'È')
-    result = result.replace('&egrave;', u'è')
-    result = result.replace('&Igrave;', u'Ì')
-    result = result.replace('&igrave;', u'ì')
-    result = result.replace('&Ograve;', u'Ò')
-    result = result.replace('&ograve;', u'ò')
-    result = result.replace('&Ugrave;', u'Ù')
-    result = result.replace('&ugrave;', u'ù')
-    result = result.replace('&Acirc;', u'Â')
-    result = result.replace('&acirc;', u'â')
-    result = result.replace('&Ecirc;', u'Ê')
-    result = result.replace('&ecirc;', u'ê')
-    result = result.replace('&Icirc;', u'Î')
-    result = result.replace('&icirc;', u'î')
-    result = result.replace('&Ocirc;', u'Ô')
-    result = result.replace('&ocirc;', u'ô')
-    result = result.replace('&Ucirc;', u'Û')
-    result = result.replace('&ucirc;', u'û')
-    result = result.replace('&Aring;', u'Å')
-    result = result.replace('&aring;', u'å')
-    result = result.replace('&deg;', u'°')
-    return result
+    return _SYMBOL_RE.sub(lambda match: SYMBOL_TABLE[match.group(0)], text)
@@ -35,7 +35,8 @@ setup(
     ],
     extras_require={
         'kerberos': ['kerberos-sspi ; platform_system=="Windows"',
-                     'kerberos ; platform_system!="Windows"']
+                     'kerberos ; platform_system!="Windows"'],
+        'async': ['aiohttp ; python_version>="3.5"']
     },
     platforms='Platform Independent',
 